@@ -1,47 +1,227 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from ultralytics import YOLO
+import torch
 import cv2
 import numpy as np
-from PIL import Image
 import io
-import base64
 import os
-import uuid
+import sys
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-import json
+import orjson
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
 # Global variables
 model = None
-UPLOAD_FOLDER = 'uploads'
-RESULTS_FOLDER = 'results'
-MODEL_PATH = 'D:/plastic_detection_project/best.pt'
+CLASS_NAMES = ()
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Annotated images are kept for as long as clients may cache them
+ANNOTATED_TTL = 3600
+SWEEP_INTERVAL = 60
+last_sweep = 0.0
+sweep_lock = threading.Lock()
+INT8_MODEL_PATH = 'D:/plastic_detection_project/best_int8.engine'
+MODEL_PATH = 'D:/plastic_detection_project/best.engine'
+CALIB_DATA = 'D:/plastic_detection_project/calib.yaml'
+WEIGHTS_PATH = 'D:/plastic_detection_project/best.pt'
+IMG_SIZE = 640
+MAX_BATCH = 8
+DEVICE = 'cpu'
+HALF = False
+
+torch.set_float32_matmul_precision('high')
+
+# Device, pinned input buffer and CUDA stream, set up by init_inference()
+host_buf = None
+stream = None
+inference_lock = threading.Lock()
+
+# Upload decoding runs in parallel (cv2.imdecode releases the GIL)
+decode_pool = ThreadPoolExecutor(max_workers=8)
 
 # Create necessary directories
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
-def load_model():
-    """Load the trained YOLO model"""
+def export_engine(int8=False):
+    """Export the trained weights to a TensorRT engine (run once at deploy time)"""
+    options = {'int8': True, 'data': CALIB_DATA} if int8 else {'half': True}
+    # Ultralytics always writes <weights>.engine next to the weights, so export
+    # from a private copy to keep the FP16 and INT8 engines from clobbering each other
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(WEIGHTS_PATH)) as tmp_dir:
+        weights_copy = shutil.copy(WEIGHTS_PATH, tmp_dir)
+        engine_path = YOLO(weights_copy).export(
+            format='engine',
+            imgsz=IMG_SIZE,
+            dynamic=True,
+            batch=MAX_BATCH,
+            workspace=4,
+            **options
+        )
+        os.replace(engine_path, INT8_MODEL_PATH if int8 else MODEL_PATH)
+
+def load_weights():
+    """Load the TensorRT engine, falling back to the PyTorch weights"""
     global model
+    # Prefer the INT8 engine, keeping FP16 as fallback
+    for engine_path in (INT8_MODEL_PATH, MODEL_PATH):
+        try:
+            if os.path.exists(engine_path):
+                model = YOLO(engine_path, task='detect')
+                # Engines deserialize lazily, so warm up here to surface a bad engine
+                prepare_model()
+                print(f"✅ TensorRT engine loaded successfully from {engine_path}")
+                return True
+            else:
+                print(f"❌ Engine file not found: {engine_path}")
+        except Exception as e:
+            model = None
+            print(f"❌ Error loading engine: {str(e)}")
+    
+    # Fall back to the PyTorch weights
     try:
-        if os.path.exists(MODEL_PATH):
-            model = YOLO(MODEL_PATH)
-            print(f"✅ Model loaded successfully from {MODEL_PATH}")
+        if os.path.exists(WEIGHTS_PATH):
+            model = YOLO(WEIGHTS_PATH)
+            if HALF:
+                model.model.half()
+            prepare_model()
+            print(f"✅ Model loaded successfully from {WEIGHTS_PATH}")
             return True
         else:
-            print(f"❌ Model file not found: {MODEL_PATH}")
+            print(f"❌ Model file not found: {WEIGHTS_PATH}")
             # Fallback to pretrained model for testing
             model = YOLO('yolov8n.pt')
+            if HALF:
+                model.model.half()
+            prepare_model()
             print("⚠️  Using pretrained YOLOv8n model as fallback")
             return False
     except Exception as e:
+        model = None
         print(f"❌ Error loading model: {str(e)}")
         return False
 
+def init_inference():
+    """Set up CUDA state (kept out of import so nothing touches CUDA before a fork)"""
+    global DEVICE, HALF, host_buf, stream
+    if host_buf is not None:
+        return
+    DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+    # FP16 only pays off on Tensor Core GPUs (SM 7.0+); Pascal cards regress
+    HALF = DEVICE == 'cuda' and torch.cuda.get_device_capability()[0] >= 7
+    host_buf = torch.empty(
+        (MAX_BATCH, 3, IMG_SIZE, IMG_SIZE),
+        dtype=torch.float16 if HALF else torch.float32,
+        pin_memory=DEVICE == 'cuda'
+    )
+    stream = torch.cuda.Stream() if DEVICE == 'cuda' else None
+
+def prepare_model():
+    """Warm up the loaded model and cache its class names (raises if it can't run)"""
+    global CLASS_NAMES
+    # Warm up so engine setup and cuDNN autotune don't hit the first request
+    dummy = np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+    for _ in range(2):
+        run_inference([dummy], 0.25)
+    CLASS_NAMES = tuple(model.names[i] for i in range(len(model.names)))
+
+def load_model():
+    """Load the trained YOLO model"""
+    init_inference()
+    return load_weights()
+
+def sweep_results():
+    """Delete annotated images older than ANNOTATED_TTL (at most once per SWEEP_INTERVAL)"""
+    global last_sweep
+    now = time.time()
+    if now - last_sweep < SWEEP_INTERVAL or not sweep_lock.acquire(blocking=False):
+        return
+    try:
+        last_sweep = now
+        for entry in os.scandir(RESULTS_FOLDER):
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > ANNOTATED_TTL:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+    finally:
+        sweep_lock.release()
+
+def save_annotated_image(file_id, data):
+    """Atomically write an annotated image so a partial file is never served"""
+    path = os.path.join(RESULTS_FOLDER, f"{file_id}.jpg")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as img_file:
+        img_file.write(data)
+    os.replace(tmp_path, path)
+    sweep_results()
+
+def decode_image(file):
+    """Decode an uploaded image file in memory (None if it isn't an image)"""
+    return cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
+
+def letterbox_params(h, w):
+    """Scale and top/left padding that letterbox an h x w image into IMG_SIZE"""
+    r = min(IMG_SIZE / h, IMG_SIZE / w)
+    new_w, new_h = max(1, round(w * r)), max(1, round(h * r))
+    top = round((IMG_SIZE - new_h) / 2 - 0.1)
+    left = round((IMG_SIZE - new_w) / 2 - 0.1)
+    return r, new_w, new_h, top, left
+
+def preprocess_image(img):
+    """Letterbox like Ultralytics, then BGR->RGB, normalize and HWC->CHW in one pass"""
+    h, w = img.shape[:2]
+    r, new_w, new_h, top, left = letterbox_params(h, w)
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    img = cv2.copyMakeBorder(
+        img, top, IMG_SIZE - new_h - top, left, IMG_SIZE - new_w - left,
+        cv2.BORDER_CONSTANT, value=(114, 114, 114)
+    )
+    return cv2.dnn.blobFromImage(img, 1 / 255.0, swapRB=True)
+
+def restore_results(results, imgs):
+    """Map results from the letterboxed tensors back onto the original images"""
+    for result, img in zip(results, imgs):
+        h, w = img.shape[:2]
+        r, _, _, top, left = letterbox_params(h, w)
+        boxes = result.boxes.data.clone()
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - left) / r
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - top) / r
+        result.orig_img = img
+        result.orig_shape = (h, w)
+        result.update(boxes=boxes)
+    return results
+
+def run_inference(imgs, conf):
+    """Run detection on decoded images through the shared pinned buffer"""
+    results = []
+    for start in range(0, len(imgs), MAX_BATCH):
+        chunk = imgs[start:start + MAX_BATCH]
+        n = len(chunk)
+        # Preprocess outside the lock so concurrent requests overlap on the CPU
+        blobs = [preprocess_image(img) for img in chunk]
+        with inference_lock:
+            for i, blob in enumerate(blobs):
+                host_buf[i].copy_(torch.from_numpy(blob[0]))
+            with torch.cuda.stream(stream) if stream is not None else nullcontext():
+                dev = host_buf[:n].to(DEVICE, non_blocking=True)
+                chunk_results = model.predict(source=dev, conf=conf, half=HALF, save=False)
+                # Rescale on the same stream so freed outputs can't be reused mid-read
+                chunk_results = restore_results(chunk_results, chunk)
+            if stream is not None:
+                stream.synchronize()
+        results.extend(chunk_results)
+    return results
+
 def process_detection_results(results):
     """Process YOLO detection results and extract information"""
     if not results or len(results) == 0:
@@ -73,28 +253,30 @@ def process_detection_results(results):
     
     # Extract detection information
     detections = len(boxes)
-    confidences = boxes.conf.cpu().numpy() if boxes.conf is not None else []
-    classes = boxes.cls.cpu().numpy() if boxes.cls is not None else []
-    xyxy = boxes.xyxy.cpu().numpy() if boxes.xyxy is not None else []
+    # boxes.data already packs xyxy, conf and cls, so one copy covers all three
+    data = boxes.data.cpu().numpy()
+    xyxy = data[:, :4]
+    confidences = data[:, -2]
+    classes = data[:, -1]
     
     # Calculate average confidence
-    avg_confidence = float(np.mean(confidences)) if len(confidences) > 0 else 0.0
+    avg_confidence = float(np.mean(confidences))
     
-    # Get class names (assuming single class 'plastic' for now)
-    class_names = ['plastic'] * len(classes)  # Update this based on your model classes
+    # Get class names from the model's class table
+    class_names = [CLASS_NAMES[i] for i in classes.astype(np.int64)]
     
     # Create bounding boxes info
-    bounding_boxes = []
-    for i in range(len(xyxy)):
-        box = {
-            'x1': float(xyxy[i][0]),
-            'y1': float(xyxy[i][1]),
-            'x2': float(xyxy[i][2]),
-            'y2': float(xyxy[i][3]),
-            'confidence': float(confidences[i]) if i < len(confidences) else 0.0,
-            'class': class_names[i] if i < len(class_names) else 'plastic'
+    bounding_boxes = [
+        {
+            'x1': b[0],
+            'y1': b[1],
+            'x2': b[2],
+            'y2': b[3],
+            'confidence': c,
+            'class': name
         }
-        bounding_boxes.append(box)
+        for b, c, name in zip(xyxy.tolist(), confidences.tolist(), class_names)
+    ]
     
     # Determine environmental impact
     severity = 'High' if detections > 5 else 'Medium' if detections > 1 else 'Low'
@@ -140,45 +322,31 @@ def detect_plastic():
         if file.filename == '':
             return jsonify({'error': 'No image file selected'}), 400
         
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        filename = f"{file_id}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        # Generate unique ID
+        file_id = secrets.token_hex(16)
         
-        # Save uploaded file
-        file.save(filepath)
+        # Decode uploaded file in memory
+        img = decode_image(file)
+        if img is None:
+            return jsonify({'error': 'Invalid image file'}), 400
         
         # Get confidence threshold from request
         confidence_threshold = float(request.form.get('confidence', 0.25))
         
         # Run detection
-        results = model.predict(
-            source=filepath,
-            conf=confidence_threshold,
-            save=True,
-            project=RESULTS_FOLDER,
-            name=file_id,
-            exist_ok=True
-        )
+        results = run_inference([img], confidence_threshold)
         
         # Process results
         detection_data = process_detection_results(results)
         
-        # Find the annotated image path
-        # Find the annotated image path
-        annotated_path = None
-        result_dir = os.path.join(RESULTS_FOLDER, file_id)
-        if os.path.exists(result_dir):
-            for result_file in os.listdir(result_dir):  # ← Changed variable name
-                if result_file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    annotated_path = os.path.join(result_dir, result_file)
-                    break
-        
-        # Convert annotated image to base64 if available
-        annotated_image_b64 = None
-        if annotated_path and os.path.exists(annotated_path):
-            with open(annotated_path, 'rb') as img_file:
-                annotated_image_b64 = base64.b64encode(img_file.read()).decode('utf-8')
+        # Save the annotated image so it can be served with sendfile
+        annotated_image_url = None
+        if results:
+            annotated = results[0].plot()
+            ok, buf = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if ok:
+                save_annotated_image(file_id, buf.tobytes())
+                annotated_image_url = f"/api/annotated/{file_id}"
         
         # Prepare response
         response = {
@@ -187,19 +355,27 @@ def detect_plastic():
             'filename': file.filename,
             'timestamp': datetime.now().isoformat(),
             'detection_results': detection_data,
-            'annotated_image': annotated_image_b64
+            'annotated_image_url': annotated_image_url
         }
         
-        # Clean up uploaded file
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        return jsonify(response)
+        return Response(orjson.dumps(response), mimetype='application/json')
         
     except Exception as e:
         print(f"Error in detection: {str(e)}")
         return jsonify({'error': f'Detection failed: {str(e)}'}), 500
 
+@app.route('/api/annotated/<file_id>', methods=['GET'])
+def get_annotated_image(file_id):
+    """Serve an annotated detection image"""
+    return send_from_directory(
+        RESULTS_FOLDER,
+        f"{file_id}.jpg",
+        mimetype='image/jpeg',
+        conditional=True,
+        etag=True,
+        max_age=ANNOTATED_TTL
+    )
+
 @app.route('/api/download-report/<file_id>', methods=['GET'])
 def download_report(file_id):
     """Download detection report as JSON"""
@@ -221,14 +397,16 @@ def download_report(file_id):
             }
         }
         
-        # Create temporary file
+        # Stream the report straight from memory
         report_filename = f"plastic_detection_report_{file_id}.json"
-        report_path = os.path.join(RESULTS_FOLDER, report_filename)
-        
-        with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2)
+        payload = orjson.dumps(report, option=orjson.OPT_INDENT_2)
         
-        return send_file(report_path, as_attachment=True, download_name=report_filename)
+        return send_file(
+            io.BytesIO(payload),
+            as_attachment=True,
+            download_name=report_filename,
+            mimetype='application/json'
+        )
         
     except Exception as e:
         return jsonify({'error': f'Report generation failed: {str(e)}'}), 500
@@ -244,53 +422,46 @@ def batch_detect():
         if not files:
             return jsonify({'error': 'No image files provided'}), 400
         
-        batch_id = str(uuid.uuid4())
+        batch_id = secrets.token_hex(16)
         batch_results = []
         
-        for i, file in enumerate(files):
-            if file.filename == '':
+        # Decode all uploads in memory, in parallel
+        files = [file for file in files if file.filename != '']
+        names, imgs = [], []
+        for file, img in zip(files, decode_pool.map(decode_image, files)):
+            if img is None:
                 continue
-                
-            # Process each image
-            file_id = f"{batch_id}_{i}"
-            filename = f"{file_id}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
-            # Run detection
-            results = model.predict(
-                source=filepath,
-                conf=0.25,
-                save=True,
-                project=RESULTS_FOLDER,
-                name=file_id,
-                exist_ok=True
-            )
-            
-            detection_data = process_detection_results(results)
-            
-            batch_results.append({
-                'filename': file.filename,
-                'file_id': file_id,
-                'results': detection_data
-            })
+            names.append(file.filename)
+            imgs.append(img)
+        
+        if imgs:
+            # Run detection on the whole batch at once
+            results_list = run_inference(imgs, 0.25)
             
-            # Clean up
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            for i, (filename, result) in enumerate(zip(names, results_list)):
+                batch_results.append({
+                    'filename': filename,
+                    'file_id': f"{batch_id}_{i}",
+                    'results': process_detection_results([result])
+                })
         
-        return jsonify({
+        return Response(orjson.dumps({
             'success': True,
             'batch_id': batch_id,
             'processed_images': len(batch_results),
             'results': batch_results,
             'timestamp': datetime.now().isoformat()
-        })
+        }), mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': f'Batch processing failed: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    # Build the TensorRT engine once: python app.py --export [--int8]
+    if '--export' in sys.argv:
+        export_engine(int8='--int8' in sys.argv)
+        sys.exit(0)
+    
     print("🚀 Starting Plastic Detection API Server...")
     print("=" * 50)
     
@@ -306,8 +477,9 @@ if __name__ == '__main__':
     print("  GET  /api/health           - Health check")
     print("  POST /api/detect           - Single image detection")
     print("  POST /api/batch-detect     - Batch image detection")
+    print("  GET  /api/annotated        - Annotated detection image")
     print("  GET  /api/download-report  - Download detection report")
     print("=" * 50)
     
-    # Run the Flask app
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Run the Flask app (use wsgi.py with gunicorn in production)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
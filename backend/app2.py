@@ -3,8 +3,12 @@ from ultralytics import YOLO
 from PIL import Image
 import os
 
-# Load the trained model (put the correct path)
-model = YOLO('D:/plastic_detection_project/best.pt')
+# Load the trained model once per process (put the correct path)
+@st.cache_resource
+def get_model():
+    return YOLO('D:/plastic_detection_project/best.pt')
+
+model = get_model()
 
 st.title("Plastic Waste Detection")
 st.write("Upload an image to detect plastics in it.")
@@ -0,0 +1,8 @@
+# Production entrypoint:
+#   gunicorn --workers 1 --threads 8 -k gthread wsgi:app
+# The model is loaded inside the worker (no --preload), so CUDA is never
+# initialised before the fork. With a single worker, all threads share
+# the one model and CUDA context.
+from app import app, load_model
+
+load_model()
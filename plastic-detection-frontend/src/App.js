@@ -87,6 +87,10 @@ const PlasticDetectionApp = () => {
       console.log('API Response:', data);
       
       if (data.success) {
+        // Resolve the annotated image URL against the server that answered
+        if (data.annotated_image_url) {
+          data.annotated_image_url = new URL(data.annotated_image_url, response.url).href;
+        }
         setResults(data);
         console.log('Detection successful:', data.detection_results);
       } else {
@@ -395,7 +399,7 @@ const PlasticDetectionApp = () => {
           {results && results.success && (
             <>
               {/* Annotated Image */}
-              {results.annotated_image && (
+              {results.annotated_image_url && (
                 <div style={{
                   backgroundColor: 'white',
                   padding: '20px',
@@ -406,7 +410,7 @@ const PlasticDetectionApp = () => {
                   <h2 style={{ color: '#2d5a27', marginBottom: '15px' }}>Detection Results</h2>
                   <div style={{ position: 'relative' }}>
                     <img
-                      src={`data:image/jpeg;base64,${results.annotated_image}`}
+                      src={results.annotated_image_url}
                       alt="Detection Results"
                       style={{ 
                         width: '100%', 